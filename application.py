@@ -8,12 +8,17 @@ each headline based on sentiment analyis. These scores are then displayed to the
 user in the context of both hourly, and daily headlines. 
 '''
 
-from urllib.request import urlopen, Request
-from bs4 import BeautifulSoup
+from cachetools import TTLCache
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import os
+from lxml import etree
+import requests
+import threading
+from requests.adapters import HTTPAdapter
 import pandas as pd
-import plotly
 import plotly.express as px
-import json
+import plotly.io as pio
 from nltk.sentiment.vader import SentimentIntensityAnalyzer
 import flask
 from flask import Flask, render_template
@@ -26,59 +31,136 @@ __maintainer__ = 'Rafid Khan'
 __email__ = 'rafid3075@gmail.com'
 __status__ = 'Production'
 
+# Loading the analyzer parses the ~7500-entry vader lexicon from disk, so
+# build it once at import rather than on every request
+VADER = SentimentIntensityAnalyzer()
+
+# Every request hits finviz.com, so keep one pooled session alive and reuse
+# its TCP/TLS connections instead of handshaking per call
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+# FinViz refreshes its headline list on a multi-minute cadence, so repeat
+# hits on a hot ticker can safely reuse the whole fetch/parse/score output.
+# TTLCache is not thread-safe, so accesses are serialized under a lock for
+# the threaded gunicorn workers
+SENTIMENT_CACHE = TTLCache(maxsize=256, ttl=90)
+SENTIMENT_CACHE_LOCK = threading.Lock()
+
+# Compiled once so each request runs a single C-level traversal that
+# returns the news rows directly
+TR_XPATH = etree.XPath("//table[@id='news-table']//tr")
+
+# Static blurb shown under the charts; only the ticker varies per request
+DESC_TMPL = """
+	The above chart averages the sentiment scores of {} stock hourly \
+    and daily.The table below gives each of the most recent \
+    headlines of the stock and the negative, neutral, positive and an \
+    aggregated sentiment score. The news headlines are obtained from \
+    the FinViz website. Sentiments are given by the \
+    nltk.sentiment.vader Python library.
+    """
+
+
+@lru_cache(maxsize=4096)
+def _score(headline):
+    '''
+    Scores a single headline with vader. FinViz repeats near-identical
+    headlines across tickers and refreshes, so memoizing on the headline
+    string turns repeat scores into a dict lookup.
+
+    :param headline: Headline text to score
+    :return: Dict of vader polarity scores for the headline
+    '''
+    return VADER.polarity_scores(headline)
+
+
+# Vader is pure Python and CPU-bound; one shared pool amortizes the worker
+# start-up cost across requests. Workers rebuild VADER when they import
+# this module, so _score_chunk needs no per-call setup.
+POOL = ProcessPoolExecutor()
+
+# Tables smaller than this score faster serially than the pool round-trip
+PARALLEL_THRESHOLD = 64
+
+
+def _score_chunk(headlines):
+    '''
+    Scores a batch of headlines inside a pool worker using the worker's
+    module-level vader instance.
+
+    :param headlines: List of headline strings to score
+    :return: List of vader polarity-score dicts, one per headline
+    '''
+    return [_score(headline) for headline in headlines]
+
 
 def get_news(ticker):
     '''
     This function takes in a stock ticker and then sends an HTTP request of
     the url containing the latest headlines related to that particular 
-    stock found on FinViz. The page element containing the headlines, and 
-    time is then returned using BeautifulSoup.  
-    
-    :param ticker: Stock ticker that will be used to query FinViz site for 
-    relevant news 
-    :return news_table: News-table element found on the accessed website 
-    (raw HTML code)
+    stock found on FinViz. The parsed document tree is then returned
+    using lxml.
+
+    :param ticker: Stock ticker that will be used to query FinViz site for
+    relevant news
+    :return tree: lxml document tree of the accessed website
     '''
     finviz_url = 'https://finviz.com/quote.ashx?t='
-    url = finviz_url + ticker
-    req = Request(url=url, headers={'user-agent': 'my-app'})
-    response = urlopen(req)
-    html = BeautifulSoup(response, 'lxml')
-    news_table = html.find(id='news-table')
-
-    return news_table
-
-
-def parse_news(news_table):
+    # Compressed transfer cuts the ~200KB page to a fraction of the bytes
+    # on the wire; requests decompresses the chunks transparently
+    headers = {'user-agent': 'my-app',
+               'accept-encoding': 'gzip, deflate'}
+    response = SESSION.get(finviz_url + ticker, headers=headers, timeout=5,
+                           stream=True)
+    # Surface FinViz 4xx/5xx responses (e.g. rate limiting) here instead
+    # of parsing the error page and failing obscurely downstream
+    response.raise_for_status()
+    # Feed the body into lxml as it downloads so tokenization overlaps
+    # the network transfer instead of waiting for the full page
+    parser = etree.HTMLPullParser()
+    for chunk in response.iter_content(chunk_size=8192):
+        parser.feed(chunk)
+    tree = parser.close()
+
+    return tree
+
+
+def parse_news(tree):
     '''
-    Takes in raw HTML code (news_table) and uses the BeautifulSoup library to 
-    parse headlines and corresponding dates/times into a Pandas DataFrame
+    Takes in the document tree and uses the lxml library to parse
+    headlines and corresponding dates/times into a Pandas DataFrame
 
-    :param news_table: News-table element found on the accessed website 
-    (raw HTML code)
-    :return parsed_news_df: Pandas DataFrame containing parsed headlines and 
+    :param tree: lxml document tree of the accessed website
+    :return parsed_news_df: Pandas DataFrame containing parsed headlines and
     corresponding dates & time
     '''
 
     parsed_news = []
-    for x in news_table.findAll('tr'):
-        try:
-            text = x.a.get_text()
-            date_scrape = x.td.text.split()
-
-            if len(date_scrape) == 1:
-                time = date_scrape[0]
-            else:
-                date = date_scrape[0]
-                time = date_scrape[1]
-
-            parsed_news.append([date, time, text])
-            columns = ['date', 'time', 'headline']
-            parsed_news_df = pd.DataFrame(parsed_news, columns=columns)
-            parsed_news_df['datetime'] = pd.to_datetime \
-                (parsed_news_df['date'] + ' ' + parsed_news_df['time'])
-        except AttributeError:
+    for row in TR_XPATH(tree):
+        # Header/spacer rows have no link; a cheap guard beats raising
+        # and unwinding an AttributeError for every skipped row
+        link = row.find('.//a')
+        cell = row.find('./td')
+        if link is None or cell is None:
             continue
+        # itertext joins all descendant text like bs4's get_text did;
+        # .text alone is None when the text sits in a nested element
+        parsed_news.append([''.join(cell.itertext()),
+                            ''.join(link.itertext())])
+
+    parsed_news_df = pd.DataFrame(parsed_news, columns=['raw', 'headline'])
+    # FinViz omits the date cell when it matches the previous row, so
+    # time-only rows inherit the last explicit date via a forward fill.
+    # The cells end in &nbsp; padding, which str.split(n=1) would leave on
+    # the time part and the strict to_datetime format would reject
+    split = parsed_news_df['raw'].str.strip().str.split(n=1, expand=True)
+    parsed_news_df['date'] = split[0].where(split[1].notna()).ffill()
+    parsed_news_df['time'] = split[1].fillna(split[0])
+    parsed_news_df['datetime'] = pd.to_datetime \
+        (parsed_news_df['date'] + ' ' + parsed_news_df['time'],
+         format='%b-%d-%y %I:%M%p')
+    parsed_news_df = parsed_news_df.drop(columns=['raw'])
 
     return parsed_news_df
 
@@ -94,15 +176,30 @@ def score_news(parsed_news_df):
     :return parsed_and_scored_news: Pandas DataFrame containing parsed 
     headlines + date/time as well as sentiment scores
     '''
-    vader = SentimentIntensityAnalyzer()
-    # Iterate through the headlines and get the polarity scores using vader
-    scores = parsed_news_df['headline'].apply(vader.polarity_scores).tolist()
-    # Convert the 'scores' list of dicts into a DataFrame
-    scores_df = pd.DataFrame(scores)
-
-    # Join the DataFrames of the news and the list of dicts
-    parsed_and_scored_news = parsed_news_df.join(scores_df, rsuffix='_right')
-    parsed_and_scored_news = parsed_and_scored_news.set_index('datetime')
+    # Iterate through the headlines and get the polarity scores using vader;
+    # large tables are split across the process pool, one chunk per core
+    headlines = parsed_news_df['headline'].tolist()
+    if len(headlines) > PARALLEL_THRESHOLD:
+        n_chunks = os.cpu_count() or 1
+        size = -(-len(headlines) // n_chunks)
+        chunks = [headlines[i:i + size]
+                  for i in range(0, len(headlines), size)]
+        scores = [score for chunk in POOL.map(_score_chunk, chunks)
+                  for score in chunk]
+    else:
+        scores = [_score(headline) for headline in headlines]
+
+    # Write the score columns straight onto the news DataFrame; the rows
+    # line up one-to-one so the join/alignment machinery is unnecessary.
+    # float32 is plenty of precision for vader's scores and halves the
+    # bandwidth of the downstream mean reductions
+    score_columns = ['neg', 'neu', 'pos', 'compound']
+    for key in score_columns:
+        parsed_news_df[key] = [score[key] for score in scores]
+    parsed_news_df[score_columns] = \
+        parsed_news_df[score_columns].astype('float32')
+
+    parsed_and_scored_news = parsed_news_df.set_index('datetime')
     parsed_and_scored_news = parsed_and_scored_news.drop(['date', 'time'], 1)
     parsed_and_scored_news = parsed_and_scored_news.rename\
         (columns={"compound": "sentiment_score"})
@@ -110,37 +207,45 @@ def score_news(parsed_news_df):
     return parsed_and_scored_news
 
 
-def plot_hourly_sentiment(parsed_and_scored_news, ticker):
+def plot_hourly_sentiment(parsed_and_scored_news, hour_keys, ticker):
     '''
-    Resamples the hourly sentiment scores found in the inputted DataFrame
+    Averages the sentiment scores found in the inputted DataFrame per hour
     and charts results using the Plotly package
 
-    :param parsed_and_scored_news: Pandas DataFrame containing parsed 
+    :param parsed_and_scored_news: Pandas DataFrame containing parsed
     headlines + date/time as well as sentiment scores
-    :param ticker: Stock ticker that will be used to query FinViz site for 
-    relevant news 
-    :return fig: Figure illustrating resampled hourly sentiment scores for
+    :param hour_keys: Array of index timestamps truncated to the hour,
+    used as the groupby keys
+    :param ticker: Stock ticker that will be used to query FinViz site for
+    relevant news
+    :return fig: Figure illustrating mean hourly sentiment scores for
     ticker
     '''
-    mean_scores = parsed_and_scored_news.resample('H').mean()
+    # Only sentiment_score is plotted, so skip reducing the other columns
+    mean_scores = \
+        parsed_and_scored_news[['sentiment_score']].groupby(hour_keys).mean()
     fig = px.bar(mean_scores, x=mean_scores.index, y='sentiment_score', \
         title=ticker + ' Hourly Sentiment Scores')
     return fig
 
 
-def plot_daily_sentiment(parsed_and_scored_news, ticker):
+def plot_daily_sentiment(parsed_and_scored_news, day_keys, ticker):
     '''
-    Resamples the daily sentiment scores found in the inputted DataFrame
+    Averages the sentiment scores found in the inputted DataFrame per day
     and charts results using the Plotly package
 
-    :param parsed_and_scored_news: Pandas DataFrame containing parsed 
+    :param parsed_and_scored_news: Pandas DataFrame containing parsed
     headlines + date/time as well as sentiment scores
-    :param ticker: Stock ticker that will be used to query FinViz site for 
-    relevant news 
-    :return fig: Figure illustrating resampled daily sentiment scores for
+    :param day_keys: Array of index timestamps truncated to the day,
+    used as the groupby keys
+    :param ticker: Stock ticker that will be used to query FinViz site for
+    relevant news
+    :return fig: Figure illustrating mean daily sentiment scores for
     ticker
     '''
-    mean_scores = parsed_and_scored_news.resample('D').mean()
+    # Only sentiment_score is plotted, so skip reducing the other columns
+    mean_scores = \
+        parsed_and_scored_news[['sentiment_score']].groupby(day_keys).mean()
     fig = px.bar(mean_scores, x=mean_scores.index, y='sentiment_score', \
         title=ticker + ' Daily Sentiment Scores')
     return fig
@@ -157,29 +262,35 @@ def index():
 @app.route('/sentiment', methods=['POST'])
 def sentiment():
     ticker = flask.request.form['ticker'].upper()
-    news_table = get_news(ticker)
-    parsed_news_df = parse_news(news_table)
-    parsed_and_scored_news = score_news(parsed_news_df)
-    fig_hourly = plot_hourly_sentiment(parsed_and_scored_news, ticker)
-    fig_daily = plot_daily_sentiment(parsed_and_scored_news, ticker)
-
-    graphJSON_hourly = json.dumps(fig_hourly, \
-        cls=plotly.utils.PlotlyJSONEncoder)
-    graphJSON_daily = json.dumps(fig_daily, \
-        cls=plotly.utils.PlotlyJSONEncoder)
-
+    with SENTIMENT_CACHE_LOCK:
+        cached = SENTIMENT_CACHE.get(ticker)
+    if cached is None:
+        tree = get_news(ticker)
+        parsed_news_df = parse_news(tree)
+        parsed_and_scored_news = score_news(parsed_news_df)
+        # Truncating the int64 nanosecond index is far cheaper than
+        # resample's bin construction, and both plots reuse the keys
+        index_values = parsed_and_scored_news.index.values
+        hour_keys = index_values.astype('datetime64[h]')
+        day_keys = index_values.astype('datetime64[D]')
+        fig_hourly = plot_hourly_sentiment(parsed_and_scored_news,
+                                           hour_keys, ticker)
+        fig_daily = plot_daily_sentiment(parsed_and_scored_news,
+                                         day_keys, ticker)
+
+        graphJSON_hourly = pio.to_json(fig_hourly, engine='orjson')
+        graphJSON_daily = pio.to_json(fig_daily, engine='orjson')
+        cached = (parsed_and_scored_news, graphJSON_hourly, graphJSON_daily)
+        with SENTIMENT_CACHE_LOCK:
+            SENTIMENT_CACHE[ticker] = cached
+
+    parsed_and_scored_news, graphJSON_hourly, graphJSON_daily = cached
     header = "Hourly and Daily Sentiment of {} Stock".format(ticker)
-    description = """
-	The above chart averages the sentiment scores of {} stock hourly \
-    and daily.The table below gives each of the most recent \
-    headlines of the stock and the negative, neutral, positive and an \
-    aggregated sentiment score. The news headlines are obtained from \
-    the FinViz website. Sentiments are given by the \
-    nltk.sentiment.vader Python library.
-    """.format(ticker)
+    description = DESC_TMPL.format(ticker)
     return render_template('sentiment.html', \
         graphJSON_hourly=graphJSON_hourly, graphJSON_daily=graphJSON_daily,
-        header=header, table=parsed_and_scored_news.to_html(classes='data'), \
+        header=header, \
+        rows=parsed_and_scored_news.itertuples(index=True, name=None), \
         description=description)
 
 
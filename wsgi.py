@@ -0,0 +1,15 @@
+'''
+File: wsgi.py
+WSGI entry point for serving the application under a production server
+with a worker pool, so concurrent ticker requests overlap instead of
+queueing behind the single-threaded development server:
+
+    gunicorn -w $(nproc) -k gthread --threads 8 wsgi:app
+
+Each worker keeps its own pooled FinViz session and vader analyzer.
+'''
+
+from application import app
+
+if __name__ == '__main__':
+    app.run()